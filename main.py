@@ -1,6 +1,8 @@
 import asyncio
 import asyncpg
 import os
+import time
+import zlib
 import logging
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import (
@@ -14,8 +16,11 @@ from aiogram.types import (
     ReplyKeyboardRemove,
 )
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
 from config import BOT_TOKEN, DB_CONFIG_1
-from parser import periodic_parser
+from sync import run_scheduler
+from notifications import NotificationSender, ensure_schema, toggle_subscription
+from singleflight import SingleFlight
 
 
 
@@ -24,18 +29,56 @@ logger = logging.getLogger(__name__)
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
 db_pool = None
+db_flight = SingleFlight()
+
+DB_POOL_MIN_SIZE = 2
+DB_POOL_MAX_SIZE = 20
+DB_STATEMENT_CACHE_SIZE = 256
+DB_ACQUIRE_TIMEOUT = 5
+DB_COMMAND_TIMEOUT = 10
+
+DISHES_PER_PAGE = 10
+KEYBOARD_CACHE_TTL = 300
+# Страницы клавиатур всех категорий меню и короткие ключи категорий для callback_data.
+# Кэш целиком пересобирается по TTL, поэтому содержит только существующие категории
+category_pages = {}
+category_keys = {}
+category_pages_built_at = 0.0
 
 
 async def connect_db():
     global db_pool
     if db_pool is None:
-        db_pool = await asyncpg.create_pool(**DB_CONFIG_1)
+        db_pool = await asyncpg.create_pool(
+            **DB_CONFIG_1,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            command_timeout=DB_COMMAND_TIMEOUT,
+        )
+        async with db_pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as db:
+            await ensure_schema(db)
+
+
+async def run_query(method: str, query: str, *args):
+    async with db_pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as db:
+        return await getattr(db, method)(query, *args)
+
+
+async def db_fetch(query: str, *args):
+    # Одинаковые одновременные запросы (например, после рассылки) выполняются один раз
+    return await db_flight.do(("fetch", query, args), run_query, "fetch", query, *args)
+
+
+async def db_fetchrow(query: str, *args):
+    return await db_flight.do(("fetchrow", query, args), run_query, "fetchrow", query, *args)
 
 
 async def set_main_menu():
     commands = [
         BotCommand(command="/menu", description="📜 Меню ресторана"),
-        BotCommand(command="/info", description="ℹ️ О ресторане")
+        BotCommand(command="/info", description="ℹ️ О ресторане"),
+        BotCommand(command="/subscriptions", description="🔔 Мои подписки")
     ]
     await bot.set_my_commands(commands)
 
@@ -53,8 +96,7 @@ def get_main_menu_keyboard() -> ReplyKeyboardMarkup:
 
 
 async def get_categories_keyboard() -> ReplyKeyboardMarkup:
-    async with db_pool.acquire() as db:
-        categories = await db.fetch("SELECT DISTINCT category FROM menu_items")
+    categories = await db_fetch("SELECT DISTINCT category FROM menu_items")
     keyboard = ReplyKeyboardMarkup(
         keyboard=[[KeyboardButton(text=cat["category"])] for cat in categories],
         resize_keyboard=True,
@@ -63,14 +105,89 @@ async def get_categories_keyboard() -> ReplyKeyboardMarkup:
     return keyboard
 
 
-async def get_dishes_inline_keyboard(category: str) -> InlineKeyboardMarkup:
-    async with db_pool.acquire() as db:
-        rows = await db.fetch("SELECT id, name FROM menu_items WHERE category = $1", category)
-
-    buttons = [[InlineKeyboardButton(text=row["name"], callback_data=f"dish:{row['id']}")] for row in rows]
-    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_categories")])
-
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+def category_key(category: str) -> str:
+    # callback_data ограничена 64 байтами, а название категории в UTF-8 может быть длиннее
+    return f"{zlib.crc32(category.encode()):08x}"
+
+
+def build_category_pages(category: str, rows) -> list:
+    key = category_key(category)
+    pages_count = max(1, -(-len(rows) // DISHES_PER_PAGE))
+    pages = []
+    for page in range(pages_count):
+        chunk = rows[page * DISHES_PER_PAGE:(page + 1) * DISHES_PER_PAGE]
+        buttons = [
+            [InlineKeyboardButton(text=row["name"], callback_data=f"dish:{row['id']}:{page}")]
+            for row in chunk
+        ]
+        if pages_count > 1:
+            nav = []
+            if page > 0:
+                nav.append(InlineKeyboardButton(text="◀️", callback_data=f"page:{page - 1}:{key}"))
+            nav.append(InlineKeyboardButton(text=f"{page + 1}/{pages_count}", callback_data="noop"))
+            if page < pages_count - 1:
+                nav.append(InlineKeyboardButton(text="▶️", callback_data=f"page:{page + 1}:{key}"))
+            buttons.append(nav)
+        buttons.append([InlineKeyboardButton(text="🔔 Следить за изменениями", callback_data=f"subscribe:{key}")])
+        buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_categories")])
+        pages.append(InlineKeyboardMarkup(inline_keyboard=buttons))
+    return pages
+
+
+async def rebuild_category_pages():
+    global category_pages, category_keys, category_pages_built_at
+    rows = await db_fetch("SELECT id, name, category FROM menu_items ORDER BY category, name")
+    by_category = {}
+    for row in rows:
+        by_category.setdefault(row["category"], []).append(row)
+
+    category_pages = {category: build_category_pages(category, dishes) for category, dishes in by_category.items()}
+    category_keys = {category_key(category): category for category in by_category}
+    category_pages_built_at = time.monotonic()
+
+
+async def ensure_category_pages():
+    if time.monotonic() - category_pages_built_at >= KEYBOARD_CACHE_TTL:
+        await db_flight.do(("rebuild_category_pages",), rebuild_category_pages)
+
+
+async def get_category_pages(category: str) -> list:
+    """
+    Возвращает заранее собранные страницы клавиатуры категории.
+    Пустой список — такой категории в меню нет.
+    """
+    await ensure_category_pages()
+    return category_pages.get(category, [])
+
+
+async def resolve_category(token: str):
+    """
+    Находит категорию по ключу из callback_data.
+    Кнопки старого формата содержат само название категории.
+    """
+    await ensure_category_pages()
+    if token in category_keys:
+        return category_keys[token]
+    return token if token in category_pages else None
+
+
+async def get_dishes_inline_keyboard(category: str, page: int = 0) -> InlineKeyboardMarkup:
+    pages = await get_category_pages(category)
+    if not pages:
+        return build_category_pages(category, [])[0]
+    return pages[min(max(page, 0), len(pages) - 1)]
+
+
+def parse_page_callback(data: str):
+    """
+    Разбирает callback вида "<prefix>:<page>:<ключ категории>".
+    Кнопки старого формата "<prefix>:<категория>" открывают первую страницу.
+    """
+    _, payload = data.split(":", 1)
+    page, sep, category = payload.partition(":")
+    if not sep or not page.isdigit():
+        return 0, payload
+    return int(page), category
 
 
 @dp.message(Command("start"))
@@ -94,7 +211,28 @@ async def about_restaurant(message: Message):
     await message.answer(response)
 
 
-async def send_dish_info(message: Message, dish_record):
+@dp.message(Command("subscriptions"))
+async def subscriptions_command(message: Message):
+    async with db_pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as db:
+        rows = await db.fetch(
+            "SELECT category FROM category_subscriptions WHERE user_id = $1 ORDER BY category",
+            message.from_user.id
+        )
+    if not rows:
+        await message.answer("🔕 У вас нет подписок. Откройте категорию меню и нажмите «🔔 Следить за изменениями».")
+        return
+
+    buttons = [
+        [InlineKeyboardButton(text=f"🔕 {row['category']}", callback_data=f"subscribe:{category_key(row['category'])}")]
+        for row in rows
+    ]
+    await message.answer(
+        "🔔 Вы следите за категориями (нажмите, чтобы отписаться):",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
+
+
+async def send_dish_info(message: Message, dish_record, page: int = 0, edit: bool = False):
     dish_text = (
         f"🍽 *{dish_record['name']}*\n"
         f"💰 Цена: {dish_record['price']}\n"
@@ -108,12 +246,18 @@ async def send_dish_info(message: Message, dish_record):
         f"🛒 Присутствует в наличии: {"да" if dish_record['availability'] else "нет"}"
     )
     back_button = InlineKeyboardButton(
-        text="🔙 Назад", callback_data=f"back_to_category:{dish_record['category']}"
+        text="🔙 Назад", callback_data=f"back_to_category:{page}:{category_key(dish_record['category'])}"
     )
     back_kb = InlineKeyboardMarkup(inline_keyboard=[[back_button]])
 
     photo_path = dish_record["image_url"]
-    if os.path.exists(photo_path) and os.path.isfile(photo_path):
+    has_photo = os.path.exists(photo_path) and os.path.isfile(photo_path)
+    if edit and not has_photo and message.text:
+        await message.edit_text(dish_text, parse_mode="Markdown", reply_markup=back_kb)
+    elif has_photo:
+        if edit:
+            # Текстовое сообщение нельзя превратить в фото, поэтому заменяем его
+            await delete_message(message)
         photo = FSInputFile(photo_path)
         await message.answer_photo(
             photo=photo,
@@ -122,35 +266,42 @@ async def send_dish_info(message: Message, dish_record):
             reply_markup=back_kb
         )
     else:
+        if edit:
+            await delete_message(message)
         await message.answer(
             dish_text,
             parse_mode="Markdown",
             reply_markup=back_kb
         )
 
+
+async def delete_message(message: Message):
+    try:
+        await message.delete()
+    except TelegramBadRequest as E:
+        # Бот не может удалять сообщения старше 48 часов
+        logger.warning(f"Не удалось удалить сообщение {message.message_id}: {E}")
+
 user_selected_category = {}
 @dp.message()
 async def handle_category_selection(message: Message):
     text = message.text.strip()
-    async with db_pool.acquire() as db:
-        dishes = await db.fetch("SELECT id, name FROM menu_items WHERE category = $1", text)
+    pages = await get_category_pages(text)
 
-    if dishes:
+    if pages:
         user_selected_category[message.from_user.id] = text
-        inline_kb = await get_dishes_inline_keyboard(text)
         await message.answer(
             f"🍽 Меню категории *{text}*:",
-            reply_markup=inline_kb,
+            reply_markup=pages[0],
             parse_mode="Markdown"
         )
     else:
         category = user_selected_category.get(message.from_user.id)
         if category:
-            async with db_pool.acquire() as db:
-                dish = await db.fetchrow(
-                    "SELECT * FROM menu_items WHERE LOWER(name) = LOWER($1) AND category = $2",
-                    text, category
-                )
+            dish = await db_fetchrow(
+                "SELECT * FROM menu_items WHERE LOWER(name) = LOWER($1) AND category = $2",
+                text, category
+            )
             if dish:
                 await send_dish_info(message, dish)
             else:
@@ -160,18 +311,64 @@ async def handle_category_selection(message: Message):
 
 @dp.callback_query(lambda c: c.data.startswith("dish:"))
 async def dish_callback_handler(callback: types.CallbackQuery):
-    dish_id = int(callback.data.split(":")[1])
-    async with db_pool.acquire() as db:
-        dish = await db.fetchrow("SELECT * FROM menu_items WHERE id = $1", dish_id)
+    _, dish_id, *page = callback.data.split(":")
+    dish = await db_fetchrow("SELECT * FROM menu_items WHERE id = $1", int(dish_id))
 
     if dish:
-        await send_dish_info(callback.message, dish)
+        await send_dish_info(callback.message, dish, page=int(page[0]) if page else 0, edit=True)
     else:
         await callback.message.answer("❌ Блюдо не найдено.")
 
     await callback.answer()
 
 
+@dp.callback_query(lambda c: c.data.startswith("page:"))
+async def page_callback_handler(callback: types.CallbackQuery):
+    page, token = parse_page_callback(callback.data)
+    category = await resolve_category(token)
+    if category is None:
+        await callback.answer("❌ Категория не найдена.")
+        return
+
+    inline_kb = await get_dishes_inline_keyboard(category, page)
+    try:
+        await callback.message.edit_reply_markup(reply_markup=inline_kb)
+    except TelegramBadRequest as E:
+        # Повторное нажатие на ту же страницу — не ошибка
+        if "message is not modified" not in str(E):
+            logger.warning(f"Не удалось переключить страницу в сообщении {callback.message.message_id}: {E}")
+            await callback.answer("❌ Не удалось открыть страницу. Выберите категорию заново.")
+            return
+    await callback.answer()
+
+
+@dp.callback_query(lambda c: c.data == "noop")
+async def noop_callback_handler(callback: types.CallbackQuery):
+    await callback.answer()
+
+
+@dp.callback_query(lambda c: c.data.startswith("subscribe:"))
+async def subscribe_callback_handler(callback: types.CallbackQuery):
+    _, token = callback.data.split(":", 1)
+    category = await resolve_category(token)
+    if category is None:
+        # Категории уже нет в меню, но от неё всё ещё можно отписаться из /subscriptions
+        async with db_pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as db:
+            rows = await db.fetch(
+                "SELECT category FROM category_subscriptions WHERE user_id = $1", callback.from_user.id
+            )
+        category = next((row["category"] for row in rows if category_key(row["category"]) == token), None)
+    if category is None:
+        await callback.answer("❌ Категория не найдена.")
+        return
+
+    subscribed = await toggle_subscription(db_pool, callback.from_user.id, category, DB_ACQUIRE_TIMEOUT)
+    if subscribed:
+        await callback.answer(f"🔔 Вы будете получать изменения категории «{category}»", show_alert=True)
+    else:
+        await callback.answer(f"🔕 Вы отписались от категории «{category}»", show_alert=True)
+
+
 @dp.callback_query(lambda c: c.data == "back_to_categories")
 async def back_callback_handler(callback: types.CallbackQuery):
 
@@ -184,15 +381,26 @@ async def back_callback_handler(callback: types.CallbackQuery):
 
 @dp.callback_query(lambda c: c.data.startswith("back_to_category:"))
 async def back_to_category_handler(callback: types.CallbackQuery):
-    _, category = callback.data.split(":", 1)
-    inline_kb = await get_dishes_inline_keyboard(category)
-
-    await bot.send_message(
-        chat_id=callback.message.chat.id,
-        text=f"🍽 Меню категории *{category}*:",
-        reply_markup=inline_kb,
-        parse_mode="Markdown"
-    )
+    page, token = parse_page_callback(callback.data)
+    category = await resolve_category(token)
+    if category is None:
+        await callback.answer("❌ Категория не найдена.")
+        return
+
+    inline_kb = await get_dishes_inline_keyboard(category, page)
+    text = f"🍽 Меню категории *{category}*:"
+
+    if callback.message.text:
+        await callback.message.edit_text(text, reply_markup=inline_kb, parse_mode="Markdown")
+    else:
+        # Карточку с фото нельзя отредактировать в текст — заменяем её списком
+        await delete_message(callback.message)
+        await bot.send_message(
+            chat_id=callback.message.chat.id,
+            text=text,
+            reply_markup=inline_kb,
+            parse_mode="Markdown"
+        )
     await callback.answer()
 
 
@@ -204,7 +412,9 @@ async def start_bot():
 
 
 async def main():
-    asyncio.create_task(periodic_parser())
+    asyncio.create_task(run_scheduler())
+    await connect_db()
+    asyncio.create_task(NotificationSender(bot, db_pool, acquire_timeout=DB_ACQUIRE_TIMEOUT).run())
     await start_bot()
 
 
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import zlib
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS menu_changes (
+        id BIGSERIAL PRIMARY KEY,
+        dish_id INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        name TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        old_price TEXT,
+        new_price TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE TABLE IF NOT EXISTS category_subscriptions (
+        user_id BIGINT NOT NULL,
+        category TEXT NOT NULL,
+        PRIMARY KEY (user_id, category)
+    );
+    CREATE INDEX IF NOT EXISTS category_subscriptions_category_idx ON category_subscriptions (category);
+    CREATE TABLE IF NOT EXISTS notification_queue (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        text TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS notification_queue_next_attempt_idx ON notification_queue (next_attempt_at);
+"""
+
+# Telegram разрешает боту около 30 сообщений в секунду суммарно,
+# часть лимита оставляем на ответы пользователям
+SEND_RATE = 25
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+CLAIM_TIMEOUT = 300
+IDLE_DELAY = 5
+# Лимит Telegram общий на токен бота, поэтому рассылает только один экземпляр,
+# удерживающий этот advisory lock; остальные ждут в резерве
+SENDER_LOCK_KEY = zlib.crc32(b"notification_sender")
+STANDBY_DELAY = 30
+
+NEW, PRICE, REMOVED = "new", "price", "removed"
+
+
+async def ensure_schema(conn):
+    await conn.execute(SCHEMA)
+
+
+def diff_menu(old_rows, parsed_menu: dict, incomplete_categories=()) -> list:
+    """
+    Сравнивает блюда в базе с результатом парсинга и возвращает список изменений:
+    новые блюда, изменения цены и удалённые блюда.
+    Для категорий из incomplete_categories (часть страниц блюд не загрузилась)
+    удаления не публикуются: parser.main их блюда тоже не удаляет.
+    """
+    old = {(row["id"], row["category"]): row for row in old_rows}
+    new = {
+        (dish["SKU"], category): dish
+        for category, dishes in parsed_menu.items()
+        for dish in dishes
+        if dish.get("SKU")
+    }
+
+    changes = []
+    for key, dish in new.items():
+        row = old.get(key)
+        if row is None:
+            changes.append({"dish_id": key[0], "category": key[1], "name": dish["Название"],
+                            "kind": NEW, "old_price": None, "new_price": dish["Цена"]})
+        elif row["price"] != dish["Цена"]:
+            changes.append({"dish_id": key[0], "category": key[1], "name": dish["Название"],
+                            "kind": PRICE, "old_price": row["price"], "new_price": dish["Цена"]})
+
+    # Пустой результат парсинга не удаляет блюда из базы, значит и удалений нет
+    if parsed_menu:
+        for key, row in old.items():
+            if key not in new and key[1] not in incomplete_categories:
+                changes.append({"dish_id": key[0], "category": key[1], "name": row["name"],
+                                "kind": REMOVED, "old_price": row["price"], "new_price": None})
+    return changes
+
+
+def format_changes(category: str, changes: list) -> str:
+    lines = [f"🔔 Изменения в категории «{category}»:"]
+    for change in changes:
+        if change["kind"] == NEW:
+            lines.append(f"🆕 {change['name']} — {change['new_price']}")
+        elif change["kind"] == PRICE:
+            lines.append(f"💰 {change['name']}: {change['old_price']} → {change['new_price']}")
+        else:
+            lines.append(f"❌ {change['name']} больше нет в меню")
+    # Ограничение Telegram на длину сообщения — 4096 символов
+    text = "\n".join(lines)
+    return text if len(text) <= 4000 else text[:4000] + "\n…"
+
+
+async def publish_menu_changes(conn, changes: list):
+    """
+    Записывает изменения в ленту и ставит уведомления в очередь подписчикам
+    соответствующих категорий (одно сообщение на категорию).
+    """
+    if not changes:
+        return
+
+    await conn.executemany(
+        """
+        INSERT INTO menu_changes (dish_id, category, name, kind, old_price, new_price)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        """,
+        [(c["dish_id"], c["category"], c["name"], c["kind"], c["old_price"], c["new_price"]) for c in changes]
+    )
+
+    by_category = {}
+    for change in changes:
+        by_category.setdefault(change["category"], []).append(change)
+
+    for category, category_changes in by_category.items():
+        await conn.execute(
+            """
+            INSERT INTO notification_queue (user_id, text)
+            SELECT user_id, $2 FROM category_subscriptions WHERE category = $1
+            """,
+            category, format_changes(category, category_changes)
+        )
+    logging.info(f"Изменений в меню: {len(changes)}, категорий с изменениями: {len(by_category)}")
+
+
+async def toggle_subscription(db_pool, user_id: int, category: str, acquire_timeout: float = None) -> bool:
+    """
+    Подписывает пользователя на категорию или отписывает, если подписка уже была.
+    Возвращает True, если пользователь теперь подписан.
+    """
+    async with db_pool.acquire(timeout=acquire_timeout) as db:
+        deleted = await db.fetchval(
+            "DELETE FROM category_subscriptions WHERE user_id = $1 AND category = $2 RETURNING 1",
+            user_id, category
+        )
+        if deleted:
+            return False
+        await db.execute(
+            "INSERT INTO category_subscriptions (user_id, category) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+            user_id, category
+        )
+        return True
+
+
+class NotificationSender:
+    """
+    Фоновая рассылка уведомлений из notification_queue с соблюдением лимитов Telegram.
+    Запускать можно на каждом экземпляре бота: рассылает только тот, кто держит
+    advisory lock SENDER_LOCK_KEY, остальные подхватят рассылку, если он упадёт.
+    """
+
+    def __init__(self, bot, db_pool, rate: float = SEND_RATE, batch_size: int = BATCH_SIZE,
+                 acquire_timeout: float = None):
+        self.bot = bot
+        self.db_pool = db_pool
+        self.acquire_timeout = acquire_timeout
+        self.rate = rate
+        self.batch_size = batch_size
+
+    async def claim_batch(self):
+        # Помечаем сообщения как взятые в работу, отодвигая next_attempt_at:
+        # если экземпляр упадёт, через CLAIM_TIMEOUT их заберёт другой
+        async with self.db_pool.acquire(timeout=self.acquire_timeout) as db:
+            return await db.fetch(
+                """
+                UPDATE notification_queue SET next_attempt_at = now() + make_interval(secs => $2)
+                WHERE id IN (
+                    SELECT id FROM notification_queue
+                    WHERE next_attempt_at <= now()
+                    ORDER BY id
+                    LIMIT $1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, user_id, text, attempts
+                """,
+                self.batch_size, CLAIM_TIMEOUT
+            )
+
+    async def send_batch(self, batch):
+        done, failed, rate_limited, blocked_users = [], [], [], []
+        interval = 1 / self.rate
+
+        for item in batch:
+            try:
+                await self.bot.send_message(chat_id=item["user_id"], text=item["text"])
+                done.append(item["id"])
+            except TelegramRetryAfter as E:
+                logging.warning(f"Telegram просит подождать {E.retry_after} с")
+                await asyncio.sleep(E.retry_after)
+                # Ограничение скорости — не ошибка доставки, попытку не тратим
+                rate_limited.append(item["id"])
+            except TelegramForbiddenError:
+                # Пользователь заблокировал бота — подписки больше не нужны
+                blocked_users.append(item["user_id"])
+                done.append(item["id"])
+            except Exception as E:
+                logging.exception(f"Ошибка при отправке уведомления {item['id']}: {E}")
+                failed.append(item)
+            await asyncio.sleep(interval)
+
+        async with self.db_pool.acquire(timeout=self.acquire_timeout) as db:
+            if done:
+                await db.execute("DELETE FROM notification_queue WHERE id = ANY($1::bigint[])", done)
+            if blocked_users:
+                await db.execute("DELETE FROM category_subscriptions WHERE user_id = ANY($1::bigint[])",
+                                 blocked_users)
+            if rate_limited:
+                await db.execute("UPDATE notification_queue SET next_attempt_at = now() WHERE id = ANY($1::bigint[])",
+                                 rate_limited)
+            dropped = [item["id"] for item in failed if item["attempts"] + 1 >= MAX_ATTEMPTS]
+            if dropped:
+                logging.error(f"Уведомления не доставлены после {MAX_ATTEMPTS} попыток: {dropped}")
+                await db.execute("DELETE FROM notification_queue WHERE id = ANY($1::bigint[])", dropped)
+            retry = [item["id"] for item in failed if item["attempts"] + 1 < MAX_ATTEMPTS]
+            if retry:
+                await db.execute(
+                    """
+                    UPDATE notification_queue
+                    SET attempts = attempts + 1,
+                        next_attempt_at = now() + make_interval(secs => 60 * power(2, attempts))
+                    WHERE id = ANY($1::bigint[])
+                    """,
+                    retry
+                )
+
+    async def send_loop(self, lock_conn):
+        # Если соединение с блокировкой потеряно, блокировка уже снята — выходим
+        while not lock_conn.is_closed():
+            try:
+                batch = await self.claim_batch()
+                if batch:
+                    await self.send_batch(batch)
+                    continue
+            except Exception as E:
+                logging.exception(f"Ошибка рассылки уведомлений: {E}")
+            await asyncio.sleep(IDLE_DELAY)
+
+    async def run(self):
+        while True:
+            try:
+                # Соединение с блокировкой держим всё время рассылки
+                async with self.db_pool.acquire(timeout=self.acquire_timeout) as lock_conn:
+                    if await lock_conn.fetchval("SELECT pg_try_advisory_lock($1)", SENDER_LOCK_KEY):
+                        logging.info("Этот экземпляр бота рассылает уведомления.")
+                        try:
+                            await self.send_loop(lock_conn)
+                        finally:
+                            if not lock_conn.is_closed():
+                                await lock_conn.execute("SELECT pg_advisory_unlock($1)", SENDER_LOCK_KEY)
+            except Exception as E:
+                logging.exception(f"Ошибка рассылки уведомлений: {E}")
+            await asyncio.sleep(STANDBY_DELAY)
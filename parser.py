@@ -10,6 +10,8 @@ import aiofiles
 from bs4 import BeautifulSoup
 from playwright.async_api import async_playwright
 from config import DB_CONFIG_1, BASE_URL
+from notifications import diff_menu, ensure_schema, publish_menu_changes
+from profiling import span, timed
 
 MENU_URL = f"{BASE_URL}/menu"
 
@@ -60,6 +62,7 @@ async def scroll_to_bottom(page, pause_time: float = SCROLL_PAUSE_TIME, max_scro
             break
 
 
+@timed("get_categories_and_dishes")
 async def get_categories_and_dishes(page, url: str) -> dict:
     logging.info(f"Переходим на страницу: {url}")
     await page.goto(url, timeout=60000, wait_until="domcontentloaded")
@@ -86,6 +89,7 @@ async def get_categories_and_dishes(page, url: str) -> dict:
     return categories
 
 
+@timed("fetch")
 async def fetch(url, session, retries=3, delay_range=FETCH_DELAY_RANGE):
 
     for attempt in range(retries):
@@ -103,6 +107,7 @@ async def fetch(url, session, retries=3, delay_range=FETCH_DELAY_RANGE):
     return None
 
 
+@timed("download_image")
 async def download_image(img_url, session, category, dish_name):
     if not img_url or img_url == "Нет фото":
         return "Нет фото"
@@ -143,85 +148,86 @@ async def parse_dish(url, session, category, semaphore):
             return None
 
         try:
-            soup = BeautifulSoup(html, "html.parser")
-
-            sku = None
-            script_tag = soup.find("script", type="application/ld+json")
-            if script_tag:
-                try:
-                    data = json.loads(script_tag.string)
-                    if isinstance(data, dict) and data.get("@type") == "Product":
-                        sku = int(data.get("sku"))
-                except Exception as Except:
-                    logging.warning(f"Ошибка парсинга JSON-LD для SKU на {url}: {Except}")
-
-            item_info = soup.find("div", id="itemInfo")
-            if not item_info:
-                logging.error(f"Блок itemInfo не найден на {url}")
-                return None
-
-            name_tag = item_info.find("h1", class_="itemTitle")
-            name = clean_text(name_tag.text) if name_tag else "Нет названия"
-
-            description_tag = item_info.find("div", class_="itemDesc")
-            description = clean_text(description_tag.text) if description_tag else "Нет описания"
-
-            price_tag = item_info.find("div", class_="itemPrice")
-            if price_tag:
-                raw_price = price_tag.get_text(strip=True)
-                price = parse_price(raw_price)
-            else:
-                price = "Нет цены"
-
-            nutrition_values = {}
-            nutrition_section = item_info.find("div", class_="itemAboutValueContent")
-            if nutrition_section:
-                for stat in nutrition_section.find_all("div", class_="itemStat"):
-                    key_tag = stat.find("span")
-                    if key_tag:
-                        key = clean_text(key_tag.text)
-                        value = stat.text.replace(key, "")
-                        value = clean_text(value)
-                        nutrition_values[key] = value
-
-            composition = "Нет состава"
-            composition_section = item_info.find("div", class_="itemAboutCompositionContent")
-            if composition_section:
-                composition_p = composition_section.find("p")
-                if composition_p:
-                    composition = clean_text(composition_p.text)
-
-            allergens_section = item_info.find("p", style="font-style: italic")
-            allergens = clean_text(allergens_section.text) if allergens_section else "Аллергены: отсутствуют"
-
-            img_url = "Нет фото"
-
-            item_image_div = soup.find("div", id="itemImage")
-            if item_image_div:
-                img_tag = item_image_div.find("img", itemprop="contentUrl")
-                if img_tag and img_tag.has_attr("src"):
-                    img_url = img_tag["src"]
-
-            if img_url == "Нет фото":
-                slider = soup.find("div", id="itemSlider")
-                if slider:
-                    first_slide = slider.find("div", class_="itemSlide")
-                    if first_slide:
-                        img_tag = first_slide.find("img", itemprop="contentUrl")
-                        if img_tag and img_tag.has_attr("src"):
-                            img_url = img_tag["src"]
-
-            if img_url != "Нет фото":
-                if img_url.lower().endswith(".svg"):
-                    img_url = "Нет фото"
-                elif not img_url.startswith("http"):
-                    img_url = BASE_URL + img_url
+            with span("parse_dish"):
+                soup = BeautifulSoup(html, "html.parser")
+
+                sku = None
+                script_tag = soup.find("script", type="application/ld+json")
+                if script_tag:
+                    try:
+                        data = json.loads(script_tag.string)
+                        if isinstance(data, dict) and data.get("@type") == "Product":
+                            sku = int(data.get("sku"))
+                    except Exception as Except:
+                        logging.warning(f"Ошибка парсинга JSON-LD для SKU на {url}: {Except}")
+
+                item_info = soup.find("div", id="itemInfo")
+                if not item_info:
+                    logging.error(f"Блок itemInfo не найден на {url}")
+                    return None
+
+                name_tag = item_info.find("h1", class_="itemTitle")
+                name = clean_text(name_tag.text) if name_tag else "Нет названия"
+
+                description_tag = item_info.find("div", class_="itemDesc")
+                description = clean_text(description_tag.text) if description_tag else "Нет описания"
+
+                price_tag = item_info.find("div", class_="itemPrice")
+                if price_tag:
+                    raw_price = price_tag.get_text(strip=True)
+                    price = parse_price(raw_price)
+                else:
+                    price = "Нет цены"
+
+                nutrition_values = {}
+                nutrition_section = item_info.find("div", class_="itemAboutValueContent")
+                if nutrition_section:
+                    for stat in nutrition_section.find_all("div", class_="itemStat"):
+                        key_tag = stat.find("span")
+                        if key_tag:
+                            key = clean_text(key_tag.text)
+                            value = stat.text.replace(key, "")
+                            value = clean_text(value)
+                            nutrition_values[key] = value
+
+                composition = "Нет состава"
+                composition_section = item_info.find("div", class_="itemAboutCompositionContent")
+                if composition_section:
+                    composition_p = composition_section.find("p")
+                    if composition_p:
+                        composition = clean_text(composition_p.text)
+
+                allergens_section = item_info.find("p", style="font-style: italic")
+                allergens = clean_text(allergens_section.text) if allergens_section else "Аллергены: отсутствуют"
+
+                img_url = "Нет фото"
+
+                item_image_div = soup.find("div", id="itemImage")
+                if item_image_div:
+                    img_tag = item_image_div.find("img", itemprop="contentUrl")
+                    if img_tag and img_tag.has_attr("src"):
+                        img_url = img_tag["src"]
+
+                if img_url == "Нет фото":
+                    slider = soup.find("div", id="itemSlider")
+                    if slider:
+                        first_slide = slider.find("div", class_="itemSlide")
+                        if first_slide:
+                            img_tag = first_slide.find("img", itemprop="contentUrl")
+                            if img_tag and img_tag.has_attr("src"):
+                                img_url = img_tag["src"]
+
+                if img_url != "Нет фото":
+                    if img_url.lower().endswith(".svg"):
+                        img_url = "Нет фото"
+                    elif not img_url.startswith("http"):
+                        img_url = BASE_URL + img_url
+
+                time_label = soup.find("div", class_="timeLabel")
+                timetable = time_label.get_text(strip=True) if time_label else ""
 
             processed_img = await download_image(img_url, session, category, name)
 
-            time_label = soup.find("div", class_="timeLabel")
-            timetable = time_label.get_text(strip=True) if time_label else ""
-
             return {
                 "SKU": sku,
                 "Категория": category,
@@ -240,7 +246,8 @@ async def parse_dish(url, session, category, semaphore):
             return None
 
 
-async def save_dishes_to_db(db_pool, dishes: list):
+@timed("save_dishes_to_db")
+async def save_dishes_to_db(conn, dishes: list):
     if not dishes:
         return
 
@@ -288,16 +295,16 @@ async def save_dishes_to_db(db_pool, dishes: list):
         params_list.append((sku, category, name, price, calories,
                             proteins, fats, carbs, weight,
                             description, composition, allergens, img_url, availability, timetable))
-    async with db_pool.acquire() as conn:
-        await conn.executemany(query, params_list)
+    await conn.executemany(query, params_list)
 
 
-async def main():
+async def main(db_pool=None, max_concurrency=MAX_CONCURRENT_REQUESTS):
     parsed_menu = {}
 
     async with async_playwright() as p:
         logging.info("Запуск браузера Playwright для сбора категорий...")
-        browser = await p.chromium.launch(headless=True)
+        with span("playwright_launch"):
+            browser = await p.chromium.launch(headless=True)
         context = await browser.new_context()
         page = await context.new_page()
         categories_dict = await get_categories_and_dishes(page, MENU_URL)
@@ -310,51 +317,106 @@ async def main():
     for category in categories_dict:
         parsed_menu[category] = []
 
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    semaphore = asyncio.Semaphore(max_concurrency)
     connector = aiohttp.TCPConnector(ssl=False)
     async with aiohttp.ClientSession(connector=connector) as session:
         tasks = []
+        task_categories = []
         for category, urls in categories_dict.items():
             for url in urls:
                 tasks.append(parse_dish(url, session, category, semaphore))
+                task_categories.append(category)
         results = await asyncio.gather(*tasks)
-        for dish in results:
+        # Категории, где хотя бы одну страницу блюда не удалось разобрать
+        incomplete_categories = set()
+        for category, dish in zip(task_categories, results):
             if dish:
                 parsed_menu[dish["Категория"]].append(dish)
+            else:
+                incomplete_categories.add(category)
 
-    db_pool = await asyncpg.create_pool(**DB_CONFIG_1, min_size=1, max_size=10)
-    for category, dishes in parsed_menu.items():
-        await save_dishes_to_db(db_pool, dishes)
+    own_pool = db_pool is None
+    if own_pool:
+        db_pool = await asyncpg.create_pool(**DB_CONFIG_1, min_size=1, max_size=10)
 
+    # Сравнение, запись блюд, удаление и публикация изменений — одна транзакция:
+    # если синхронизация прервётся, лента изменений не разойдётся с menu_items
     async with db_pool.acquire() as conn:
-        site_categories = list(parsed_menu.keys())
-        if site_categories:
-            await conn.execute("DELETE FROM menu_items WHERE category NOT IN (SELECT unnest($1::text[]))",
-                               site_categories)
-        for category, dishes in parsed_menu.items():
-            site_skus = [dish["SKU"] for dish in dishes if dish.get("SKU")]
-            if site_skus:
-                await conn.execute(
-                    "DELETE FROM menu_items WHERE category = $1 AND NOT (id = ANY($2::integer[]))",
-                    category, site_skus
-                )
-            else:
-                await conn.execute("DELETE FROM menu_items WHERE category = $1", category)
+        await ensure_schema(conn)
+        async with conn.transaction():
+            old_rows = await conn.fetch("SELECT id, category, name, price FROM menu_items")
+            changes = diff_menu(old_rows, parsed_menu, incomplete_categories)
+
+            for category, dishes in parsed_menu.items():
+                await save_dishes_to_db(conn, dishes)
+
+            with span("prune_deletes"):
+                site_categories = list(parsed_menu.keys())
+                if site_categories:
+                    await conn.execute("DELETE FROM menu_items WHERE category NOT IN (SELECT unnest($1::text[]))",
+                                       site_categories)
+                for category, dishes in parsed_menu.items():
+                    if category in incomplete_categories:
+                        # Блюда с незагрузившихся страниц не удаляем, иначе на следующей
+                        # синхронизации они снова попадут в ленту как новые
+                        logging.warning(f"Категория «{category}» загружена не полностью, удаление блюд пропущено.")
+                        continue
+                    site_skus = [dish["SKU"] for dish in dishes if dish.get("SKU")]
+                    if site_skus:
+                        await conn.execute(
+                            "DELETE FROM menu_items WHERE category = $1 AND NOT (id = ANY($2::integer[]))",
+                            category, site_skus
+                        )
+                    else:
+                        await conn.execute("DELETE FROM menu_items WHERE category = $1", category)
+
+            with span("publish_menu_changes"):
+                await publish_menu_changes(conn, changes)
 
     logging.info("Синхронизация с сайтом завершена. Все блюда обновлены в базе данных.")
-    await db_pool.close()
-
+    if own_pool:
+        await db_pool.close()
 
-async def periodic_parser(interval=36000):
-    while True:
-        logging.info("Запуск цикла парсинга...")
-        await main()
-        logging.info(f"Ожидание {interval} секунд до следующего запуска...")
-        await asyncio.sleep(interval)
 
+async def download_missing_images(db_pool=None, max_concurrency=MAX_CONCURRENT_REQUESTS):
+    """
+    Докачивает изображения блюд, которые не удалось скачать при парсинге меню
+    (в image_url для них остался адрес на сайте вместо локального пути).
+    """
+    own_pool = db_pool is None
+    if own_pool:
+        db_pool = await asyncpg.create_pool(**DB_CONFIG_1, min_size=1, max_size=10)
 
-if __name__ == "__main__":
     try:
-        asyncio.run(main())
-    except Exception as e:
-        logging.exception(f"Ошибка: {e}")
\ No newline at end of file
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT id, category, name, image_url FROM menu_items WHERE image_url LIKE 'http%'"
+            )
+        if not rows:
+            logging.info("Все изображения блюд уже скачаны.")
+            return
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def download_limited(row, session):
+            async with semaphore:
+                return await download_image(row["image_url"], session, row["category"], row["name"])
+
+        connector = aiohttp.TCPConnector(ssl=False)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            paths = await asyncio.gather(*(download_limited(row, session) for row in rows))
+
+        updates = [
+            (path, row["id"], row["category"])
+            for row, path in zip(rows, paths)
+            if path != row["image_url"]
+        ]
+        if updates:
+            async with db_pool.acquire() as conn:
+                await conn.executemany(
+                    "UPDATE menu_items SET image_url = $1 WHERE id = $2 AND category = $3", updates
+                )
+        logging.info(f"Скачано изображений: {len(updates)} из {len(rows)}")
+    finally:
+        if own_pool:
+            await db_pool.close()
@@ -0,0 +1,184 @@
+import asyncio
+import cProfile
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:
+    PyinstrumentProfiler = None
+
+# SYNC_PROFILE=1 (или cprofile) — cProfile, SYNC_PROFILE=pyinstrument — pyinstrument
+PROFILE_ENV = "SYNC_PROFILE"
+PROFILE_DIR_ENV = "SYNC_PROFILE_DIR"
+DEFAULT_PROFILE_DIR = "profiles"
+
+_mode = os.getenv(PROFILE_ENV, "").strip().lower() or None
+# Отчёт текущего запуска; задачи, созданные внутри запуска, наследуют его через контекст
+_current_report = contextvars.ContextVar("current_report", default=None)
+# cProfile/pyinstrument видят весь поток, поэтому профилируемые запуски идут по одному:
+# иначе в профиль одной задачи попадают корутины остальных
+_run_lock = asyncio.Lock()
+# tracemalloc общий на процесс: его запускает первый из идущих запусков, а останавливает последний
+_active_reports = []
+_owns_tracemalloc = False
+
+
+def enable(mode: str = "cprofile"):
+    global _mode
+    _mode = mode
+
+
+def is_enabled() -> bool:
+    return _mode not in (None, "0", "false", "no")
+
+
+@contextmanager
+def span(name: str):
+    """
+    Замеряет время этапа и добавляет его в отчёт текущего запуска.
+    Вне профилируемого запуска ничего не делает.
+    """
+    report = _current_report.get()
+    if report is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage = report["stages"].setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        stage["count"] += 1
+        stage["total"] += elapsed
+        stage["max"] = max(stage["max"], elapsed)
+
+
+def timed(name: str):
+    """
+    Декоратор для корутин: весь вызов считается этапом name.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _start_profiler(report: dict):
+    try:
+        if _mode == "pyinstrument":
+            if PyinstrumentProfiler is not None:
+                profiler = PyinstrumentProfiler(async_mode="enabled")
+                profiler.start()
+                return profiler
+            logging.warning("pyinstrument не установлен, используем cProfile.")
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    except Exception as E:
+        # Например, в процессе уже работает другой профайлер
+        logging.warning(f"Не удалось запустить профайлер, собираем только тайминги этапов: {E}")
+        report["profile_skipped"] = str(E)
+        return None
+
+
+def _stop_profiler(profiler, path_prefix: str):
+    if profiler is None:
+        return None
+
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        path = f"{path_prefix}.prof"
+        profiler.dump_stats(path)
+    else:
+        profiler.stop()
+        path = f"{path_prefix}.html"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(profiler.output_html())
+    return path
+
+
+def _start_tracemalloc(report: dict):
+    global _owns_tracemalloc
+    if _active_reports:
+        # Пик памяти теперь общий для параллельных запусков, сбрасывать его нельзя
+        for active in _active_reports:
+            active["overlapped"] = True
+        report["overlapped"] = True
+    else:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _owns_tracemalloc = True
+        tracemalloc.reset_peak()
+    _active_reports.append(report)
+
+
+def _stop_tracemalloc(report: dict):
+    global _owns_tracemalloc
+    if report not in _active_reports:
+        return
+    report["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+    # При пересечении с другими запусками пик относится ко всему процессу, а не к этому запуску
+    report["peak_memory_scope"] = "process" if report["overlapped"] else "run"
+    _active_reports.remove(report)
+    if not _active_reports and _owns_tracemalloc:
+        tracemalloc.stop()
+        _owns_tracemalloc = False
+
+
+@asynccontextmanager
+async def profile_run(name: str):
+    """
+    Профилирует один запуск задачи синхронизации: тайминги этапов, cProfile/pyinstrument
+    и пик памяти по tracemalloc. Результат пишется в SYNC_PROFILE_DIR (по умолчанию profiles/).
+    """
+    if not is_enabled():
+        yield
+        return
+
+    if _run_lock.locked():
+        logging.info(f"[{name}] Ждём окончания другого профилируемого запуска...")
+    async with _run_lock:
+        async with _profile_run(name) as report:
+            yield report
+
+
+@asynccontextmanager
+async def _profile_run(name: str):
+    output_dir = os.getenv(PROFILE_DIR_ENV, DEFAULT_PROFILE_DIR)
+    os.makedirs(output_dir, exist_ok=True)
+    path_prefix = os.path.join(output_dir, f"{name}-{datetime.now():%Y%m%d-%H%M%S}")
+
+    report = {"job": name, "started_at": datetime.now().isoformat(), "stages": {}, "overlapped": False}
+    token = _current_report.set(report)
+    profiler = None
+    start = time.perf_counter()
+    try:
+        _start_tracemalloc(report)
+        profiler = _start_profiler(report)
+        yield report
+    finally:
+        report["total"] = time.perf_counter() - start
+        report["profile"] = _stop_profiler(profiler, path_prefix)
+        _stop_tracemalloc(report)
+        _current_report.reset(token)
+
+        # Этапы внутри запуска идут параллельно, поэтому сумма total может превышать время запуска
+        report["stages"] = dict(sorted(report["stages"].items(), key=lambda item: -item[1]["total"]))
+        with open(f"{path_prefix}.json", "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logging.info(f"[{name}] Отчёт профилирования: {path_prefix}.json")
+        for stage, stats in report["stages"].items():
+            logging.info(f"[{name}] {stage}: {stats['count']} раз, всего {stats['total']:.2f} с, "
+                         f"максимум {stats['max']:.2f} с")
@@ -4,14 +4,15 @@ import requests
 import asyncpg
 from bs4 import BeautifulSoup
 import asyncio
-from config import DB_CONFIG_2  # Импортируем параметры подключения из config.py
+from config import DB_CONFIG_2, BASE_URL  # Импортируем параметры подключения из config.py
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 # Константы
-BASE_URL = "https://coffeemania.ru"
 REST_URL = f"{BASE_URL}/restaurants"
+MAX_CONCURRENT_REQUESTS = 5
+REQUEST_TIMEOUT = 30
 
 
 def fetch_restaurant_data(url):
@@ -19,7 +20,7 @@ def fetch_restaurant_data(url):
     Получает данные ресторана по переданному URL.
     """
     try:
-        page = requests.get(url)
+        page = requests.get(url, timeout=REQUEST_TIMEOUT)
         page.raise_for_status()
         soup = BeautifulSoup(page.text, "html.parser")
 
@@ -88,7 +89,7 @@ def fetch_all_restaurants():
     Получает список всех ресторанов.
     Возвращает словарь, где ключ – название ресторана, а значение – URL.
     """
-    page = requests.get(REST_URL)
+    page = requests.get(REST_URL, timeout=REQUEST_TIMEOUT)
     soup = BeautifulSoup(page.text, "html.parser")
     all_rests = soup.find_all("a", class_="image-side")
     restaurants = {}
@@ -101,6 +102,8 @@ def fetch_all_restaurants():
     # Исключаем ресторан "Кофемания Chef's", если он не нужен
     restaurants.pop("Кофемания Chef's", None)
     return restaurants
+
+
 async def save_restaurants_to_db(db_pool, restaurants: list):
     if not restaurants:
         return {}
@@ -173,15 +176,37 @@ async def save_restaurants_to_db(db_pool, restaurants: list):
     return links_dict
 
 
-async def main(db_pool):
+async def main(db_pool=None, max_concurrency=MAX_CONCURRENT_REQUESTS):
     # Получаем список ресторанов
-    restaurants_dict = fetch_all_restaurants()
+    restaurants_dict = await asyncio.to_thread(fetch_all_restaurants)
     restaurant_data_list = []
 
-    for name, url in restaurants_dict.items():
-        data = fetch_restaurant_data(url)
+    # requests блокирующий, поэтому страницы ресторанов качаем в потоках,
+    # но не больше max_concurrency одновременно
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch_limited(url):
+        async with semaphore:
+            return await asyncio.to_thread(fetch_restaurant_data, url)
+
+    names = list(restaurants_dict)
+    results = await asyncio.gather(*(fetch_limited(restaurants_dict[name]) for name in names))
+
+    for name, data in zip(names, results):
         if data:
             # Добавляем имя ресторана, так как его нет в данных, полученных из fetch_restaurant_data
             data["name"] = name
             restaurant_data_list.append(data)
-            logging.info(f"Получены данные ресторана: {name}")
\ No newline at end of file
+            logging.info(f"Получены данные ресторана: {name}")
+
+    own_pool = db_pool is None
+    if own_pool:
+        db_pool = await asyncpg.create_pool(**DB_CONFIG_2, min_size=1, max_size=5)
+    try:
+        links_dict = await save_restaurants_to_db(db_pool, restaurant_data_list)
+    finally:
+        if own_pool:
+            await db_pool.close()
+
+    logging.info(f"Синхронизация ресторанов завершена. Обновлено ресторанов: {len(restaurant_data_list)}")
+    return links_dict
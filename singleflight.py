@@ -0,0 +1,27 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые запросы: пока запрос с данным ключом
+    выполняется, остальные вызовы ждут его результат, а не запускают свой.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def _forget(self, key, future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        # Помечаем исключение как полученное, даже если все ожидающие отменились
+        if not future.cancelled():
+            future.exception()
+
+    async def do(self, key, func, *args):
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func(*args))
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        # shield: отмена одного ожидающего не должна отменять запрос для остальных
+        return await asyncio.shield(future)
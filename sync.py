@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import logging
+import random
+import zlib
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+import asyncpg
+
+import parser as menu_parser
+import profiling
+import rest
+from config import DB_CONFIG_1, DB_CONFIG_2
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Если задача пропущена из-за блокировки, пробуем снова раньше обычного интервала
+LOCK_RETRY_DELAY = 300
+
+
+@dataclass
+class SyncJob:
+    """
+    Задача синхронизации: что запускать, с какой БД работать и как часто.
+    """
+    name: str
+    run: Callable[..., Awaitable]  # async def run(db_pool, max_concurrency)
+    db_config: dict
+    interval: float
+    jitter: float = 0
+    concurrency: int = 1
+    pool_size: int = 5
+    # Максимальная длительность запуска, чтобы зависшая задача не держала блокировку вечно
+    timeout: float = 3600
+    # Задачи с одной группой блокировки никогда не выполняются одновременно
+    lock_group: str = None
+
+    @property
+    def lock_key(self) -> int:
+        # Ключ advisory lock должен совпадать у всех экземпляров сервиса
+        return zlib.crc32(f"sync:{self.lock_group or self.name}".encode())
+
+    @property
+    def local_lock(self) -> asyncio.Lock:
+        return _local_locks.setdefault(self.lock_key, asyncio.Lock())
+
+
+_local_locks = {}
+
+
+JOBS = {
+    job.name: job
+    for job in (
+        SyncJob("menu", menu_parser.main, DB_CONFIG_1, interval=36000, jitter=600,
+                concurrency=menu_parser.MAX_CONCURRENT_REQUESTS, pool_size=10, timeout=3 * 3600,
+                lock_group="menu_images"),
+        SyncJob("restaurants", rest.main, DB_CONFIG_2, interval=86400, jitter=1800,
+                concurrency=rest.MAX_CONCURRENT_REQUESTS),
+        # images пишет в те же файлы images/ и menu_items.image_url, что и menu
+        SyncJob("images", menu_parser.download_missing_images, DB_CONFIG_1, interval=3600, jitter=300,
+                concurrency=5, lock_group="menu_images"),
+    )
+}
+
+
+async def run_job(job: SyncJob) -> bool:
+    """
+    Один запуск задачи. Возвращает False, если задача (или задача из той же
+    группы блокировки) уже выполняется в этом процессе или на другом экземпляре сервиса.
+    """
+    if job.local_lock.locked():
+        logging.info(f"[{job.name}] Задача уже выполняется в этом процессе, пропускаем.")
+        return False
+
+    async with job.local_lock:
+        # Сессионный advisory lock держим на отдельном соединении, чтобы он
+        # не освободился при возврате соединения в пул
+        lock_conn = await asyncpg.connect(**job.db_config)
+        try:
+            if not await lock_conn.fetchval("SELECT pg_try_advisory_lock($1)", job.lock_key):
+                logging.info(f"[{job.name}] Задача выполняется на другом экземпляре, пропускаем.")
+                return False
+            try:
+                logging.info(f"[{job.name}] Запуск синхронизации...")
+                async with asyncpg.create_pool(**job.db_config, min_size=1, max_size=job.pool_size) as db_pool:
+                    async with profiling.profile_run(job.name):
+                        await asyncio.wait_for(job.run(db_pool, max_concurrency=job.concurrency), job.timeout)
+                logging.info(f"[{job.name}] Синхронизация завершена.")
+                return True
+            finally:
+                await lock_conn.execute("SELECT pg_advisory_unlock($1)", job.lock_key)
+        finally:
+            await lock_conn.close()
+
+
+async def job_loop(job: SyncJob):
+    while True:
+        completed = True
+        try:
+            completed = await run_job(job)
+        except asyncio.TimeoutError:
+            logging.error(f"[{job.name}] Синхронизация не уложилась в {job.timeout:.0f} секунд и прервана.")
+        except Exception as E:
+            logging.exception(f"[{job.name}] Ошибка синхронизации: {E}")
+
+        if completed:
+            delay = job.interval + random.uniform(0, job.jitter)
+        else:
+            delay = min(job.interval, LOCK_RETRY_DELAY) + random.uniform(0, job.jitter)
+        logging.info(f"[{job.name}] Ожидание {delay:.0f} секунд до следующего запуска...")
+        await asyncio.sleep(delay)
+
+
+async def run_scheduler(names=None):
+    """
+    Запускает циклы выбранных задач параллельно (по умолчанию — все задачи).
+    """
+    jobs = [JOBS[name] for name in (names or JOBS)]
+    await asyncio.gather(*(job_loop(job) for job in jobs))
+
+
+def parse_args(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Синхронизация данных Кофемании с сайтом")
+    arg_parser.add_argument(
+        "--profile", action="store_true",
+        help=f"профилировать запуски задач (то же, что {profiling.PROFILE_ENV}=cprofile|pyinstrument)"
+    )
+    arg_parser.add_argument(
+        "--profiler", choices=["cprofile", "pyinstrument"], default="cprofile",
+        help="профайлер для --profile (по умолчанию cprofile)"
+    )
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+
+    serve = subparsers.add_parser("serve", help="запустить планировщик")
+    serve.add_argument("jobs", nargs="*", help=f"задачи из {', '.join(JOBS)} (по умолчанию все)")
+
+    run = subparsers.add_parser("run", help="однократно запустить задачи")
+    run.add_argument("jobs", nargs="+", choices=list(JOBS))
+
+    subparsers.add_parser("list", help="список задач")
+    args = arg_parser.parse_args(argv)
+
+    # argparse не умеет сочетать nargs="*" с choices, поэтому проверяем сами
+    unknown = [name for name in getattr(args, "jobs", []) if name not in JOBS]
+    if unknown:
+        arg_parser.error(f"неизвестные задачи: {', '.join(unknown)}")
+    return args
+
+
+async def cli(args):
+    if args.profile:
+        profiling.enable(args.profiler)
+    if args.command == "serve":
+        await run_scheduler(args.jobs)
+    elif args.command == "run":
+        await asyncio.gather(*(run_job(JOBS[name]) for name in args.jobs))
+    elif args.command == "list":
+        for job in JOBS.values():
+            print(f"{job.name}: каждые {job.interval:.0f}±{job.jitter:.0f} с, параллельность {job.concurrency}")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(cli(parse_args()))
+    except Exception as e:
+        logging.exception(f"Ошибка: {e}")